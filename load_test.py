@@ -0,0 +1,502 @@
+"""Load test for the Telegram Admin Bot.
+
+Simulates many admins using the bot at once by putting synthetic updates on the
+Application's update queue, so they are dispatched concurrently exactly like polled
+updates. The Bot API is replaced by an in-process stub and Telethon clients by
+a fake account, so no network access or real credentials are needed.
+
+Usage:
+    python load_test.py --admins 20 --iterations 50 --phones 200
+"""
+import argparse
+import asyncio
+import copy
+import functools
+import importlib
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ConversationHandler, TypeHandler
+from telegram.request import BaseRequest
+
+from telethon import errors, types
+
+# Imported by main() once inside the scratch directory, since importing it opens bot.log
+telegram_bot = None
+
+BOT_TOKEN = "123456:LOAD-TEST"
+GROUP_USERNAME = "@loadtestgroup"
+
+# Relative weights of the operations in the mixed workload
+WORKLOAD = {
+    "start": 3,
+    "help": 1,
+    "menu_manage_blocked": 2,
+    "menu_back": 2,
+    "block_user": 1,
+    "unblock_user": 1,
+    "upload_csv": 2,
+    "add_to_group": 1,
+    "stats": 1,
+    "jobs": 1,
+}
+
+# Stubbed Bot API
+class StubBotRequest(BaseRequest):
+    """Answer Bot API calls in-process and count them per endpoint."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.files = {}
+        self.message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        if "/file/bot" in url:
+            # Download of a file returned by getFile
+            file_id = url.rsplit("/", 1)[-1].removesuffix(".csv")
+            self.calls["download"] += 1
+            return 200, self.files[file_id]
+
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        parameters = request_data.parameters if request_data else {}
+
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        elif endpoint == "getFile":
+            file_id = parameters["file_id"]
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files[file_id]),
+                "file_path": f"documents/{file_id}.csv",
+            }
+        elif endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(parameters.get("chat_id", 0)), "type": "private"},
+                "text": parameters.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+# Fake Telethon
+class FakeTelegramClient:
+    """Stand-in for TelegramClient that answers requests like a real account would."""
+
+    def __init__(self, latency, found_ratio, rng):
+        self.latency = latency
+        self.found_ratio = found_ratio
+        self.rng = rng
+        self.connected = False
+
+    async def _delay(self):
+        await asyncio.sleep(self.rng.uniform(0, 2 * self.latency))
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        await self._delay()
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    def _user(self, user_id, phone=None):
+        return types.User(
+            id=user_id,
+            access_hash=user_id * 7,
+            first_name=f"user{user_id}",
+            username=f"user{user_id}",
+            phone=phone,
+            status=types.UserStatusRecently(),
+        )
+
+    async def get_entity(self, entity):
+        await self._delay()
+        if isinstance(entity, str):
+            return SimpleNamespace(id=abs(hash(entity)) % 10**9)
+        return self._user(entity)
+
+    async def __call__(self, request):
+        await self._delay()
+        name = type(request).__name__
+        if name == "ImportContactsRequest":
+            phone = request.contacts[0].phone
+            if self.rng.random() >= self.found_ratio:
+                return SimpleNamespace(users=[])
+            return SimpleNamespace(users=[self._user(int(phone.lstrip("+")) % 10**9 + 1, phone)])
+        if name == "GetUsersRequest":
+            return [self._user(input_user.user_id) for input_user in request.id]
+        if name == "AddChatUserRequest":
+            roll = self.rng.random()
+            if roll < 0.05:
+                raise errors.UserAlreadyParticipantError(request=request)
+            if roll < 0.08:
+                raise errors.UserPrivacyRestrictedError(request=request)
+            if roll < 0.09:
+                raise errors.FloodWaitError(request=request, capture=1)
+        return None
+
+# Race detection on the shared session store
+MISSING = object()
+
+class RaceDetectingDict(dict):
+    """Session store that hands out copies and reports writes based on a stale read.
+
+    Every read returns a deep copy, so nested values such as blocked_users can only
+    change the store when they are written back. A write is a race when the stored
+    value changed after the writing task read it: the write then discards another
+    task's change.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.reads = {}
+        self.races = []
+
+    @staticmethod
+    def _task_name():
+        task = asyncio.current_task()
+        return task.get_name() if task else "main"
+
+    def _read(self, key, default):
+        value = super().get(key, MISSING)
+        self.reads[(self._task_name(), key)] = copy.deepcopy(value)
+        return default if value is MISSING else copy.deepcopy(value)
+
+    def _record_write(self, key, value):
+        task_name = self._task_name()
+        seen = self.reads.get((task_name, key), MISSING)
+        current = super().get(key, MISSING)
+        if (task_name, key) in self.reads and seen != current:
+            self.races.append({
+                "key": key,
+                "task": task_name,
+                "read": None if seen is MISSING else seen,
+                "current": None if current is MISSING else current,
+            })
+        self.reads[(task_name, key)] = copy.deepcopy(value)
+
+    def get(self, key, default=None):
+        return self._read(key, default)
+
+    def __getitem__(self, key):
+        value = self._read(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._record_write(key, value)
+        super().__setitem__(key, copy.deepcopy(value))
+
+    def __delitem__(self, key):
+        self._record_write(key, MISSING)
+        super().__delitem__(key)
+
+async def check_race_detection():
+    """Interleave two block-user updates with an await between read and write, and expect one race."""
+    store = RaceDetectingDict({"1": {"blocked_users": []}})
+
+    async def block(target_user_id):
+        session = store.get("1")
+        await asyncio.sleep(0)
+        session["blocked_users"].append(target_user_id)
+        store["1"] = session
+
+    await asyncio.gather(
+        asyncio.create_task(block(1), name="race-check-a"),
+        asyncio.create_task(block(2), name="race-check-b"),
+    )
+    return len(store.races) == 1 and store["1"]["blocked_users"] == [2]
+
+# Synthetic updates
+update_ids = itertools.count(1)
+
+def make_user(admin_id):
+    return {"id": admin_id, "is_bot": False, "first_name": f"admin{admin_id}"}
+
+def make_message(admin_id, text=None, document=None, caption=None):
+    message = {
+        "message_id": next(update_ids),
+        "date": int(time.time()),
+        "chat": {"id": admin_id, "type": "private"},
+        "from": make_user(admin_id),
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if document is not None:
+        message["document"] = document
+    if caption is not None:
+        message["caption"] = caption
+    return message
+
+def message_update(bot, admin_id, **kwargs):
+    return Update.de_json({"update_id": next(update_ids), "message": make_message(admin_id, **kwargs)}, bot)
+
+def callback_update(bot, admin_id, data):
+    return Update.de_json({
+        "update_id": next(update_ids),
+        "callback_query": {
+            "id": str(next(update_ids)),
+            "from": make_user(admin_id),
+            "chat_instance": str(admin_id),
+            "data": data,
+            "message": make_message(admin_id, text="menu"),
+        },
+    }, bot)
+
+def make_csv(admin_id, phones, rng):
+    """Build a contact list that changes slightly between uploads to exercise delta mode."""
+    numbers = [f"+1555{admin_id % 10000:04d}{i:04d}" for i in range(phones)]
+    rng.shuffle(numbers)
+    numbers = numbers[:max(1, int(phones * 0.9))]
+    return ("phone_number\n" + "\n".join(numbers) + "\n").encode("utf-8")
+
+def build_update(operation, bot, bot_api, admin_id, args, rng):
+    if operation == "start":
+        return message_update(bot, admin_id, text="/start")
+    if operation == "help":
+        return message_update(bot, admin_id, text="/help")
+    if operation == "stats":
+        return message_update(bot, admin_id, text="/stats")
+    if operation == "jobs":
+        return message_update(bot, admin_id, text="/jobs")
+    if operation == "menu_manage_blocked":
+        return callback_update(bot, admin_id, "manage_blocked")
+    if operation == "menu_back":
+        return callback_update(bot, admin_id, "back_to_main")
+    if operation == "block_user":
+        return message_update(bot, admin_id, text=str(rng.randint(1, 50)))
+    if operation == "unblock_user":
+        return callback_update(bot, admin_id, f"unblock_user_{rng.randint(1, 50)}")
+    if operation == "upload_csv":
+        file_id = f"csv-{admin_id}-{next(update_ids)}"
+        bot_api.files[file_id] = make_csv(admin_id, args.phones, rng)
+        document = {"file_id": file_id, "file_unique_id": file_id, "file_name": "contacts.csv", "mime_type": "text/csv"}
+        return message_update(bot, admin_id, document=document)
+    if operation == "add_to_group":
+        return message_update(bot, admin_id, text=GROUP_USERNAME)
+    raise ValueError(f"Unknown operation: {operation}")
+
+# Measurements
+def instrument_handlers(application, latencies, handler_errors):
+    """Time every handler callback of the application."""
+    def instrument(handler):
+        callback = handler.callback
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                handler_errors[name] += 1
+                raise
+            finally:
+                latencies[name].append(time.perf_counter() - started)
+
+        handler.callback = timed
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                nested = list(handler.entry_points) + list(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    nested.extend(state_handlers)
+                for nested_handler in nested:
+                    instrument(nested_handler)
+            else:
+                instrument(handler)
+
+async def monitor_loop_lag(samples, stop, interval):
+    """Measure how late the event loop wakes up a sleeping coroutine."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+# Runner
+# Handler group that runs after all of the bot's handlers, to signal that an update is done
+PROCESSED_GROUP = 100
+
+def track_processed_updates(application):
+    """Return a mapping of update ids to futures resolved once the Application has processed them."""
+    processing = {}
+
+    async def mark_processed(update, context):
+        future = processing.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    application.add_handler(TypeHandler(Update, mark_processed), group=PROCESSED_GROUP)
+    return processing
+
+async def run_admin(application, bot_api, admin_id, args, rng, operations, processing):
+    # Like a real admin, each stream waits for the bot to handle an update before sending the next
+    weights = list(WORKLOAD.values())
+    for _ in range(args.iterations):
+        operation = rng.choices(list(WORKLOAD), weights=weights)[0]
+        update = build_update(operation, application.bot, bot_api, admin_id, args, rng)
+        processed = asyncio.get_running_loop().create_future()
+        processing[update.update_id] = processed
+        await application.update_queue.put(update)
+        await processed
+        operations[operation] += 1
+
+async def run_load_test(args):
+    if not await check_race_detection():
+        raise RuntimeError("The session store race detector missed a forced race")
+
+    rng = random.Random(args.seed)
+    admin_ids = [1000 + index for index in range(args.admins)]
+
+    telegram_bot.BOT_TOKEN = BOT_TOKEN
+    telegram_bot.ADMIN_USERS[:] = admin_ids
+    telegram_bot.RATE_LIMIT_DELAY = 0
+    telegram_bot.sessions = RaceDetectingDict({
+        str(admin_id): {"string_session": "load-test", "api_id": 1, "api_hash": "load-test", "blocked_users": []}
+        for admin_id in admin_ids
+    })
+    telegram_bot.create_client = lambda string_session, api_id, api_hash: FakeTelegramClient(
+        args.api_latency, args.found_ratio, random.Random(rng.random())
+    )
+
+    bot_api = StubBotRequest()
+    application = telegram_bot.build_application(
+        ApplicationBuilder().request(bot_api).get_updates_request(StubBotRequest())
+    )
+    latencies = defaultdict(list)
+    handler_errors = Counter()
+    instrument_handlers(application, latencies, handler_errors)
+    processing = track_processed_updates(application)
+
+    operations = Counter()
+    lag_samples = []
+    stop = asyncio.Event()
+
+    await application.initialize()
+    await application.start()
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples, stop, args.lag_interval))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        asyncio.create_task(
+            run_admin(application, bot_api, admin_id, args, random.Random(rng.random()), operations, processing),
+            name=f"admin-{admin_id}-stream-{stream}",
+        )
+        for admin_id in admin_ids
+        for stream in range(args.streams)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    await application.stop()
+    await telegram_bot.close_clients()
+    await application.shutdown()
+
+    return {
+        "admins": args.admins,
+        "streams_per_admin": args.streams,
+        "elapsed_seconds": elapsed,
+        "updates": sum(operations.values()),
+        "updates_per_second": sum(operations.values()) / elapsed if elapsed else 0.0,
+        "operations": dict(operations),
+        "handlers": {
+            name: {
+                "count": len(values),
+                "errors": handler_errors.get(name, 0),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+            for name, values in sorted(latencies.items())
+        },
+        "event_loop_lag": {
+            "samples": len(lag_samples),
+            "p50_ms": percentile(lag_samples, 0.50) * 1000,
+            "p99_ms": percentile(lag_samples, 0.99) * 1000,
+            "max_ms": max(lag_samples, default=0.0) * 1000,
+        },
+        "session_store_races": telegram_bot.sessions.races,
+        "bot_api_calls": dict(bot_api.calls),
+    }
+
+def print_report(report):
+    print(f"Admins: {report['admins']} x {report['streams_per_admin']} stream(s)")
+    print(f"Updates: {report['updates']} in {report['elapsed_seconds']:.2f}s ({report['updates_per_second']:.1f}/s)")
+    print()
+    print(f"{'handler':<28} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in report["handlers"].items():
+        print(
+            f"{name:<28} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}"
+        )
+    lag = report["event_loop_lag"]
+    print()
+    print(f"Event loop lag: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, max {lag['max_ms']:.1f} ms")
+    races = report["session_store_races"]
+    print(f"Session store races: {len(races)}")
+    for race in races[:10]:
+        print(f"  key {race['key']} written by {race['task']} from a stale read (read {race['read']!r}, now {race['current']!r})")
+    print(f"Bot API calls: {report['bot_api_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Telegram Admin Bot with simulated admins")
+    parser.add_argument("--admins", type=int, default=10, help="number of simulated admins")
+    parser.add_argument("--streams", type=int, default=2, help="concurrent update streams per admin")
+    parser.add_argument("--iterations", type=int, default=20, help="updates sent by each stream")
+    parser.add_argument("--phones", type=int, default=100, help="phone numbers per uploaded CSV")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="mean simulated Telegram API latency in seconds")
+    parser.add_argument("--found-ratio", type=float, default=0.8, help="share of phone numbers that resolve to a user")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="event loop lag sampling interval in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for a reproducible workload")
+    parser.add_argument("--json", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    # Results, ledgers and sessions written by the handlers go to a scratch directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    original_cwd = os.getcwd()
+    global telegram_bot
+    with tempfile.TemporaryDirectory(prefix="load_test_") as workdir:
+        os.chdir(workdir)
+        try:
+            telegram_bot = importlib.import_module("telegram_bot")
+            report = asyncio.run(run_load_test(args))
+        finally:
+            os.chdir(original_cwd)
+
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    main()
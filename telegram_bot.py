@@ -1,22 +1,43 @@
+from __future__ import annotations
+
+import time
+
+IMPORTS_STARTED = time.perf_counter()
+
+import argparse
 import asyncio
+import importlib
 import json
+import multiprocessing
 import os
 import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import traceback
 import csv
+import enum
+import functools
+import hashlib
+import io
+import itertools
 from pathlib import Path
 import logging
+from collections import Counter, defaultdict, deque
+from contextlib import closing
+from dataclasses import dataclass
 from datetime import datetime
 
-from telethon import TelegramClient, errors, functions, types
-from telethon.sessions import StringSession
-
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InputFile,
 )
 from telegram.ext import (
+    BasePersistence,
+    PersistenceInput,
+    Application,
     ApplicationBuilder,
     ContextTypes,
     CommandHandler,
@@ -28,8 +49,7 @@ from telegram.ext import (
 
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+IMPORTS_FINISHED = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(
@@ -39,49 +59,275 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Environment variables
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-ADMIN_USERS = [int(uid) for uid in os.getenv("ADMIN_USERS", "").split(",") if uid.strip().isdigit()]
+# Telethon is only needed once an admin talks to Telegram, so it is imported on first use
+class LazyModule:
+    """Proxy that imports a module the first time one of its attributes is accessed."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+errors = LazyModule("telethon.errors")
+functions = LazyModule("telethon.functions")
+types = LazyModule("telethon.types")
 
-if not BOT_TOKEN:
-    logger.error("BOT_TOKEN is not set in the .env file.")
-    exit("BOT_TOKEN is not set in the .env file.")
+# Environment variables, populated by load_config()
+BOT_TOKEN = None
+ADMIN_USERS = []
+
+def load_config():
+    """Load the bot token and admin list from the .env file."""
+    global BOT_TOKEN
+    load_dotenv()
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+    ADMIN_USERS[:] = [int(uid) for uid in os.getenv("ADMIN_USERS", "").split(",") if uid.strip().isdigit()]
+
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN is not set in the .env file.")
+        exit("BOT_TOKEN is not set in the .env file.")
 
 # File to store sessions
 SESSIONS_FILE = 'sessions.json'
 
-# Load existing sessions
-if os.path.exists(SESSIONS_FILE):
-    with open(SESSIONS_FILE, 'r') as f:
-        sessions = json.load(f)
-else:
-    sessions = {}
+# Sessions are loaded from disk on first access
+sessions = None
+
+def load_sessions():
+    global sessions
+    if sessions is None:
+        if os.path.exists(SESSIONS_FILE):
+            with open(SESSIONS_FILE, 'r') as f:
+                sessions = json.load(f)
+        else:
+            sessions = {}
+    return sessions
 
 # Helper functions to manage sessions
 def save_sessions():
-    with open(SESSIONS_FILE, 'w') as f:
-        json.dump(sessions, f, indent=4)
+    # Worker processes read this file, so it is replaced atomically
+    replace_file(Path(SESSIONS_FILE), lambda f: json.dump(load_sessions(), f, indent=4))
 
 def get_session(user_id):
-    return sessions.get(str(user_id), {})
+    return load_sessions().get(str(user_id), {})
 
 def set_session(user_id, session_data):
-    sessions[str(user_id)] = session_data
+    load_sessions()[str(user_id)] = session_data
     save_sessions()
 
 def remove_session(user_id):
-    if str(user_id) in sessions:
+    if str(user_id) in load_sessions():
         del sessions[str(user_id)]
         save_sessions()
 
+# Connected Telethon clients, keyed by admin user ID as (string_session, client)
+clients = {}
+client_locks = {}
+
+def create_client(string_session, api_id, api_hash):
+    """Create a Telethon client, importing Telethon on first use."""
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+    return TelegramClient(StringSession(string_session), api_id, api_hash)
+
+async def get_client(user_id):
+    """Return a connected client for the admin's stored session, or None if not set up."""
+    session_data = get_session(user_id)
+    string_session = session_data.get("string_session")
+    api_id = session_data.get("api_id")
+    api_hash = session_data.get("api_hash")
+    if not string_session or not api_id or not api_hash:
+        return None
+
+    lock = client_locks.setdefault(str(user_id), asyncio.Lock())
+    async with lock:
+        cached = clients.get(str(user_id))
+        telemetry.record_cache("clients", cached is not None and cached[0] == string_session)
+        if cached is not None and cached[0] != string_session:
+            # The admin logged in again, drop the client of the old session
+            await cached[1].disconnect()
+            cached = None
+        if cached is None:
+            cached = (string_session, create_client(string_session, api_id, api_hash))
+            clients[str(user_id)] = cached
+        client = cached[1]
+        if not client.is_connected():
+            await client.connect()
+    return client
+
+async def drop_client(user_id):
+    """Disconnect and forget the cached client of an admin."""
+    cached = clients.pop(str(user_id), None)
+    if cached is not None:
+        await cached[1].disconnect()
+
+async def warm_clients(owns=lambda user_id: True):
+    """Connect the clients of all stored sessions in the background."""
+    user_ids = [user_id for user_id in list(load_sessions()) if owns(int(user_id))]
+    if not user_ids:
+        return
+    # Import Telethon in a worker thread so create_client() does not block the event loop
+    await asyncio.to_thread(importlib.import_module, "telethon")
+    for user_id in user_ids:
+        try:
+            await get_client(user_id)
+        except Exception as e:
+            logger.warning(f"Failed to warm Telethon client for {user_id}: {e}")
+    logger.info(f"Warmed {len(clients)} Telethon client(s).")
+
+async def close_clients():
+    for user_id in list(clients):
+        await drop_client(user_id)
+
 # Define states for ConversationHandler
 (
     API_ID, API_HASH, PHONE_NUMBER, CODE, PASSWORD,
     BLOCK_USER_ID
 ) = range(6)
 
-# Initialize the Telegram Bot application
-application = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
+# Number of interactive jobs (CSV uploads, group additions) currently running
+active_jobs = 0
+
+def interactive_job(handler):
+    """Mark a handler as an interactive job so background work pauses while it runs."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        global active_jobs
+        active_jobs += 1
+        try:
+            return await handler(update, context)
+        finally:
+            active_jobs -= 1
+    return wrapper
+
+# In-memory runtime telemetry served by /stats and /jobs
+TELEMETRY_WINDOW = 60  # Seconds used for throughput rates
+TELEMETRY_BUFFER_SIZE = 1000  # Events kept per ring buffer
+JOB_RATE_SAMPLES = 100  # Progress samples kept per job for rows/sec and ETA
+FINISHED_JOBS_KEPT = 20
+
+class Job:
+    """Progress of a CSV upload or add-to-group run."""
+
+    __slots__ = ("job_id", "kind", "user_id", "total", "done", "started_at", "finished_at", "samples")
+
+    def __init__(self, job_id, kind, user_id, total):
+        self.job_id = job_id
+        self.kind = kind
+        self.user_id = user_id
+        self.total = total
+        self.done = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.samples = deque([self.started_at], maxlen=JOB_RATE_SAMPLES)
+
+    def advance(self, count=1):
+        self.done += count
+        self.samples.append(time.monotonic())
+
+    def rate(self):
+        """Rows per second over the most recent progress samples."""
+        if len(self.samples) < 2:
+            return 0.0
+        span = self.samples[-1] - self.samples[0]
+        return (len(self.samples) - 1) / span if span > 0 else 0.0
+
+    def eta(self):
+        rate = self.rate()
+        if self.finished_at is not None or rate == 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+class Telemetry:
+    """Aggregate counters and ring buffers that are cheap to update and to read."""
+
+    def __init__(self):
+        self.requests = defaultdict(lambda: deque(maxlen=TELEMETRY_BUFFER_SIZE))
+        self.flood_wait = defaultdict(float)
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+        self.active = {}
+        self.finished = deque(maxlen=FINISHED_JOBS_KEPT)
+        self.job_ids = itertools.count(1)
+
+    def record_request(self, user_id):
+        self.requests[str(user_id)].append(time.monotonic())
+
+    def record_flood_wait(self, user_id, seconds):
+        self.flood_wait[str(user_id)] += seconds
+
+    def record_cache(self, name, hit):
+        if hit:
+            self.cache_hits[name] += 1
+        else:
+            self.cache_misses[name] += 1
+
+    def snapshot(self):
+        """Counters of this process, sent by workers so the frontend can show them in /stats."""
+        cutoff = time.monotonic() - TELEMETRY_WINDOW
+        return {
+            "requests": {user_id: [t for t in timestamps if t >= cutoff] for user_id, timestamps in self.requests.items()},
+            "flood_wait": dict(self.flood_wait),
+            "cache_hits": dict(self.cache_hits),
+            "cache_misses": dict(self.cache_misses),
+        }
+
+    def merge(self, snapshot):
+        for user_id, timestamps in snapshot["requests"].items():
+            self.requests[user_id].extend(timestamps)
+        for name in ("flood_wait", "cache_hits", "cache_misses"):
+            counters = getattr(self, name)
+            for key, value in snapshot[name].items():
+                counters[key] += value
+
+    def throughput(self, user_id):
+        """Requests per second of a session over the telemetry window."""
+        cutoff = time.monotonic() - TELEMETRY_WINDOW
+        recent = sum(1 for timestamp in self.requests[str(user_id)] if timestamp >= cutoff)
+        return recent / TELEMETRY_WINDOW
+
+    def start_job(self, kind, user_id, total):
+        job = Job(next(self.job_ids), kind, user_id, total)
+        self.active[job.job_id] = job
+        return job
+
+    def finish_job(self, job):
+        job.finished_at = time.monotonic()
+        self.active.pop(job.job_id, None)
+        self.finished.append(job)
+
+telemetry = Telemetry()
+
+class JobReporter:
+    """Relay the progress of a job to the admin and to telemetry."""
+
+    def __init__(self, update, kind, user_id):
+        self.update = update
+        self.kind = kind
+        self.user_id = user_id
+        self.job = None
+
+    async def start(self, total):
+        self.job = telemetry.start_job(self.kind, self.user_id, total)
+
+    async def progress(self, flood_seconds=0):
+        telemetry.record_request(self.user_id)
+        if flood_seconds:
+            telemetry.record_flood_wait(self.user_id, flood_seconds)
+        if self.job is not None:
+            self.job.advance()
+
+    async def message(self, text):
+        if self.update is not None:
+            await self.update.message.reply_text(text)
+
+    def finish(self):
+        if self.job is not None:
+            telemetry.finish_job(self.job)
 
 # Function to check if user is admin
 def is_admin(user_id):
@@ -127,7 +373,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📄 **دستورات و گزینه‌ها:**\n\n"
         "/start - شروع ربات و نمایش گزینه‌ها\n"
         "/help - نمایش پیام راهنما\n"
-        "/add_admin - افزودن ادمین جدید\n\n"
+        "/add_admin - افزودن ادمین جدید\n"
+        "/export\\_ledger @group - دریافت گزارش افزودن کاربران به گروه\n"
+        "/stats - نمایش آمار لحظه‌ای ربات\n"
+        "/jobs - نمایش کارهای در حال اجرا و پایان یافته\n\n"
         "**گزینه‌ها از طریق دکمه‌ها:**\n"
         "• 🔑 تنظیم حساب تلگرام\n"
         "• 📂 آپلود مخاطبین CSV\n"
@@ -176,6 +425,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif data == "logout":
         remove_session(user_id)
+        await drop_client(user_id)
         await query.edit_message_text("🔒 از حساب تلگرام خارج شدید.")
         await start_command(update, context)
         return
@@ -252,125 +502,130 @@ async def phone_number_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     api_hash = context.user_data['api_hash']
     phone = context.user_data['phone_number']
 
-    client = TelegramClient(StringSession(), api_id, api_hash)
+    client = create_client(None, api_id, api_hash)
 
     try:
         await client.connect()
         if not await client.is_user_authorized():
-            await client.send_code_request(phone)
+            sent_code = await client.send_code_request(phone)
             await update.message.reply_text("📩 یک کد تایید به شماره تلفن شما ارسال شد. لطفاً کد را وارد کنید:")
-            context.user_data['client'] = client
+            # Keep the half-finished login as a StringSession instead of a live client
+            context.user_data['pending_login'] = {
+                "string_session": client.session.save(),
+                "phone_code_hash": sent_code.phone_code_hash,
+                "started_at": time.time(),
+            }
             return CODE
         else:
             # Already authorized
-            string_session = client.session.save()
-            set_session(user_id, {
-                "string_session": string_session,
-                "api_id": api_id,
-                "api_hash": api_hash,
-                "blocked_users": []
-            })
-            await client.disconnect()
-            await update.message.reply_text("✅ حساب تلگرام شما با موفقیت تنظیم شد!")
-            await start_command(update, context)
+            await complete_login(update, context, client)
             return ConversationHandler.END
     except errors.ApiIdInvalidError:
-        await client.disconnect()
         await update.message.reply_text("❌ `API_ID` یا `API_HASH` نامعتبر است. لطفاً دوباره امتحان کنید:")
         return API_ID
     except Exception as e:
-        await client.disconnect()
         logger.exception(f"Error during authentication: {e}")
         await update.message.reply_text("❌ خطایی رخ داد. لطفاً دوباره امتحان کنید.")
         return ConversationHandler.END
+    finally:
+        await client.disconnect()
 
 async def code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     code = update.message.text.strip()
-    client = context.user_data.get('client')
+    client = resume_pending_login(context)
 
     if not client:
         await update.message.reply_text("❌ خطا در دسترسی به جلسه. لطفاً دوباره تنظیم کنید.")
         return ConversationHandler.END
 
     try:
-        await client.sign_in(phone=context.user_data['phone_number'], code=code)
+        await client.connect()
+        await client.sign_in(
+            phone=context.user_data['phone_number'],
+            code=code,
+            phone_code_hash=context.user_data['pending_login']['phone_code_hash']
+        )
+        await complete_login(update, context, client)
+        return ConversationHandler.END
     except errors.SessionPasswordNeededError:
+        context.user_data['pending_login']['string_session'] = client.session.save()
         await update.message.reply_text("🔒 احراز هویت دو مرحله‌ای فعال است. لطفاً رمز عبور خود را وارد کنید:")
         return PASSWORD
-    except errors.CodeInvalidError:
+    except (errors.PhoneCodeInvalidError, errors.CodeInvalidError):
         await update.message.reply_text("❌ کد تایید نامعتبر است. لطفاً دوباره کد را وارد کنید:")
         return CODE
     except Exception as e:
-        await client.disconnect()
         logger.exception(f"Error during sign in: {e}")
+        context.user_data.pop('pending_login', None)
         await update.message.reply_text("❌ خطایی رخ داد. لطفاً دوباره امتحان کنید.")
         return ConversationHandler.END
-
-    # Authentication successful
-    string_session = client.session.save()
-    user_id = update.effective_user.id
-    api_id = context.user_data['api_id']
-    api_hash = context.user_data['api_hash']
-    set_session(user_id, {
-        "string_session": string_session,
-        "api_id": api_id,
-        "api_hash": api_hash,
-        "blocked_users": []
-    })
-    await client.disconnect()
-    await update.message.reply_text("✅ حساب تلگرام شما با موفقیت تنظیم شد!")
-    await start_command(update, context)
-    return ConversationHandler.END
+    finally:
+        await client.disconnect()
 
 async def password_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     password = update.message.text.strip()
-    client = context.user_data.get('client')
+    client = resume_pending_login(context)
 
     if not client:
         await update.message.reply_text("❌ خطا در دسترسی به جلسه. لطفاً دوباره تنظیم کنید.")
         return ConversationHandler.END
 
     try:
+        await client.connect()
         await client.sign_in(password=password)
+        await complete_login(update, context, client)
+        return ConversationHandler.END
     except errors.PasswordHashInvalidError:
         await update.message.reply_text("❌ رمز عبور نادرست است. لطفاً دوباره وارد کنید:")
         return PASSWORD
     except Exception as e:
-        await client.disconnect()
         logger.exception(f"Error during password sign in: {e}")
+        context.user_data.pop('pending_login', None)
         await update.message.reply_text("❌ خطایی رخ داد. لطفاً دوباره امتحان کنید.")
         return ConversationHandler.END
+    finally:
+        await client.disconnect()
 
+# Pending logins older than this are discarded
+LOGIN_TIMEOUT = 10 * 60
+LOGIN_REAP_INTERVAL = 60
+
+def resume_pending_login(context: ContextTypes.DEFAULT_TYPE):
+    """Recreate the client of a pending login from its StringSession, or None if it expired."""
+    pending = context.user_data.get('pending_login')
+    if not pending:
+        return None
+    if time.time() - pending["started_at"] > LOGIN_TIMEOUT:
+        context.user_data.pop('pending_login', None)
+        return None
+    return create_client(pending["string_session"], context.user_data['api_id'], context.user_data['api_hash'])
+
+async def complete_login(update: Update, context: ContextTypes.DEFAULT_TYPE, client):
+    """Store the session of a successful login and clear the login state."""
     # Authentication successful
-    string_session = client.session.save()
     user_id = update.effective_user.id
-    api_id = context.user_data['api_id']
-    api_hash = context.user_data['api_hash']
     set_session(user_id, {
-        "string_session": string_session,
-        "api_id": api_id,
-        "api_hash": api_hash,
-        "blocked_users": []
+        "string_session": client.session.save(),
+        "api_id": context.user_data['api_id'],
+        "api_hash": context.user_data['api_hash'],
+        "blocked_users": get_session(user_id).get("blocked_users", [])
     })
-    await client.disconnect()
+    for key in ('api_id', 'api_hash', 'phone_number', 'pending_login'):
+        context.user_data.pop(key, None)
     await update.message.reply_text("✅ حساب تلگرام شما با موفقیت تنظیم شد!")
     await start_command(update, context)
-    return ConversationHandler.END
 
-# Conversation Handler Setup
-setup_telegram_conv = ConversationHandler(
-    entry_points=[CallbackQueryHandler(button_handler, pattern='^setup_telegram$')],
-    states={
-        API_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_id_handler)],
-        API_HASH: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_hash_handler)],
-        PHONE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, phone_number_handler)],
-        CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, code_handler)],
-        PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, password_handler)],
-        BLOCK_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, block_user_input)],
-    },
-    fallbacks=[],
-    allow_reentry=True
-)
+async def reap_pending_logins(application: Application):
+    """Periodically drop pending logins that were abandoned."""
+    while True:
+        await asyncio.sleep(LOGIN_REAP_INTERVAL)
+        for user_id, user_data in list(application.user_data.items()):
+            pending = user_data.get('pending_login')
+            if pending and time.time() - pending["started_at"] > LOGIN_TIMEOUT:
+                user_data.pop('pending_login', None)
+                # No update touched this user, so the change has to be marked for persistence
+                application.mark_data_for_update_persistence(user_ids=user_id)
+                logger.info(f"Discarded abandoned login of {user_id}")
 
 # Handler to add new admin via command
 async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -408,7 +663,279 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             admin_users_str = ",".join(map(str, ADMIN_USERS))
             f.write(f"ADMIN_USERS={admin_users_str}\n")
 
+# Delay between Telegram requests of one job, to avoid hitting API rate limits
+RATE_LIMIT_DELAY = 1
+
+# Caption that forces a full re-scan instead of delta mode
+FULL_SCAN_CAPTION = "full"
+
+# Helper functions for JSON files, run in a worker thread to keep the event loop responsive
+def read_json_file(path):
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def replace_file(path, write):
+    """Write a file through a temporary file of its own, then swap it in atomically."""
+    # Every writer gets a unique temporary file, so concurrent writers never share one
+    # and the previous version stays intact until the new one is complete
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+def write_json_file(path, data):
+    # json.dump streams the encoded chunks to disk
+    replace_file(path, lambda f: json.dump(data, f, indent=4, ensure_ascii=False))
+
+async def send_file(message, path, filename, caption):
+    """Reply with a file whose content is read off the event loop."""
+    content = await asyncio.to_thread(path.read_bytes)
+    await message.reply_document(document=content, filename=filename, caption=caption)
+
+# Compact record model for resolution results
+class UserStatus(enum.Enum):
+    ONLINE = "online"
+    OFFLINE = "offline"
+    RECENTLY = "recently"
+    LAST_WEEK = "last_week"
+    LAST_MONTH = "last_month"
+    UNKNOWN = "unknown"
+
+class ResultError(enum.Enum):
+    NOT_SET_UP = "not_set_up"
+    BLOCKED = "blocked"
+    NOT_FOUND = "not_found"
+    MULTIPLE_MATCHES = "multiple_matches"
+    UNEXPECTED = "unexpected"
+    OTHER = "other"
+
+# Localized texts, only rendered when results are exported or displayed
+USER_STATUS_TEXT = {
+    UserStatus.ONLINE: "آنلاین است",
+    UserStatus.RECENTLY: "به تازگی دیده شده",
+    UserStatus.LAST_WEEK: "هفته گذشته دیده شده",
+    UserStatus.LAST_MONTH: "ماه گذشته دیده شده",
+    UserStatus.UNKNOWN: "ناشناس",
+}
+WAS_ONLINE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+RESULT_ERROR_TEXT = {
+    ResultError.NOT_SET_UP: "حساب تلگرام شما تنظیم نشده است.",
+    ResultError.BLOCKED: "کاربر مسدود شده است.",
+    ResultError.NOT_FOUND: "هیچ پاسخی دریافت نشد، شماره تلفن در تلگرام وجود ندارد یا دسترسی اضافه کردن مخاطب مسدود شده است.",
+    ResultError.MULTIPLE_MATCHES: "این شماره تلفن با چندین حساب تلگرام مطابقت دارد، که غیرمنتظره است.",
+}
+UNEXPECTED_ERROR_PREFIX = "خطای غیرمنتظره: "
+
+@dataclass(slots=True)
+class ResolutionResult:
+    """Result of resolving one phone number, serialized to the JSON shape on export."""
+    id: int | None = None
+    access_hash: int | None = None
+    username: str | None = None
+    first_name: str | None = None
+    last_name: str | None = None
+    fake: bool | None = None
+    verified: bool | None = None
+    premium: bool | None = None
+    mutual_contact: bool | None = None
+    bot: bool | None = None
+    bot_chat_history: bool | None = None
+    restricted: bool | None = None
+    restriction_reason: list | None = None
+    status: UserStatus = UserStatus.UNKNOWN
+    was_online: datetime | None = None
+    phone: str | None = None
+    checked_at: float | None = None
+    photo_path: str | None = None
+    error: ResultError | None = None
+    error_detail: str | None = None
+
+    @property
+    def resolved(self):
+        return self.id is not None
+
+    @property
+    def reusable(self):
+        # Transient errors and blocks are retried on the next upload
+        return self.resolved or self.error is ResultError.NOT_FOUND
+
+    def user_was_online(self):
+        if self.status is UserStatus.OFFLINE and self.was_online is not None:
+            return self.was_online.strftime(WAS_ONLINE_FORMAT)
+        return USER_STATUS_TEXT.get(self.status, USER_STATUS_TEXT[UserStatus.UNKNOWN])
+
+    def error_text(self):
+        if self.error is ResultError.UNEXPECTED:
+            return f"{UNEXPECTED_ERROR_PREFIX}{self.error_detail}."
+        if self.error is ResultError.OTHER:
+            return self.error_detail
+        return RESULT_ERROR_TEXT[self.error]
+
+    def to_dict(self):
+        data = {}
+        if self.resolved:
+            data.update({
+                "id": self.id,
+                "access_hash": self.access_hash,
+                "username": self.username,
+                "first_name": self.first_name,
+                "last_name": self.last_name,
+                "fake": self.fake,
+                "verified": self.verified,
+                "premium": self.premium,
+                "mutual_contact": self.mutual_contact,
+                "bot": self.bot,
+                "bot_chat_history": self.bot_chat_history,
+                "restricted": self.restricted,
+                "restriction_reason": self.restriction_reason,
+                "user_was_online": self.user_was_online(),
+                "phone": self.phone,
+                "checked_at": datetime.fromtimestamp(self.checked_at).isoformat() if self.checked_at else None,
+            })
+            if self.photo_path:
+                data["photo_path"] = self.photo_path
+        if self.error is not None:
+            data["error"] = self.error_text()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        status, was_online = parse_user_was_online(data.get("user_was_online"))
+        error, error_detail = parse_error_text(data.get("error"))
+        checked_at = data.get("checked_at")
+        return cls(
+            id=data.get("id"),
+            access_hash=data.get("access_hash"),
+            username=data.get("username"),
+            first_name=data.get("first_name"),
+            last_name=data.get("last_name"),
+            fake=data.get("fake"),
+            verified=data.get("verified"),
+            premium=data.get("premium"),
+            mutual_contact=data.get("mutual_contact"),
+            bot=data.get("bot"),
+            bot_chat_history=data.get("bot_chat_history"),
+            restricted=data.get("restricted"),
+            restriction_reason=data.get("restriction_reason"),
+            status=status,
+            was_online=was_online,
+            phone=data.get("phone"),
+            checked_at=datetime.fromisoformat(checked_at).timestamp() if checked_at else None,
+            photo_path=data.get("photo_path"),
+            error=error,
+            error_detail=error_detail,
+        )
+
+def parse_user_was_online(text):
+    """Map an exported user_was_online text back to a status."""
+    if text is None:
+        return UserStatus.UNKNOWN, None
+    for status, status_text in USER_STATUS_TEXT.items():
+        if text == status_text:
+            return status, None
+    try:
+        return UserStatus.OFFLINE, datetime.strptime(text, WAS_ONLINE_FORMAT)
+    except ValueError:
+        return UserStatus.UNKNOWN, None
+
+def parse_error_text(text):
+    """Map an exported error text back to an error code."""
+    if text is None:
+        return None, None
+    for error, error_text in RESULT_ERROR_TEXT.items():
+        if text == error_text:
+            return error, None
+    if text.startswith(UNEXPECTED_ERROR_PREFIX):
+        return ResultError.UNEXPECTED, text[len(UNEXPECTED_ERROR_PREFIX):].rstrip(".")
+    return ResultError.OTHER, text
+
+def read_results_file(path):
+    # Files written by write_results_file hold one record per line and are parsed line by
+    # line, so only one decoded record exists at a time; other layouts are loaded whole
+    if not path.exists():
+        return {}
+    results = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line in ("{", "}", "{}"):
+                continue
+            try:
+                (phone, data), = json.loads("{" + line + "}").items()
+            except ValueError:
+                return {phone: ResolutionResult.from_dict(data) for phone, data in read_json_file(path).items()}
+            results[phone] = ResolutionResult.from_dict(data)
+    return results
+
+def write_results_file(path, results):
+    # Records are serialized one at a time so the full dict of dicts never exists in memory
+    def write(f):
+        f.write("{")
+        for index, (phone, record) in enumerate(results.items()):
+            f.write(",\n    " if index else "\n    ")
+            f.write(json.dumps(phone))
+            f.write(": ")
+            f.write(json.dumps(record.to_dict(), ensure_ascii=False))
+        f.write("\n}\n" if results else "}\n")
+    replace_file(path, write)
+
+# Helper functions to manage results and delta state
+def get_results_file(user_id):
+    return Path(f"results_{user_id}.json")
+
+def get_delta_state_file(user_id):
+    return Path(f"delta_{user_id}.json")
+
+# Serializes every load-change-save of an admin's results within this process
+results_locks = {}
+
+def results_lock(user_id):
+    return results_locks.setdefault(str(user_id), asyncio.Lock())
+
+def get_results_version(user_id):
+    """Modification time of the results file, to notice writes made by other processes."""
+    try:
+        return get_results_file(user_id).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+async def load_results(user_id):
+    return await asyncio.to_thread(read_results_file, get_results_file(user_id))
+
+async def save_results(user_id, results):
+    await asyncio.to_thread(write_results_file, get_results_file(user_id), results)
+
+async def load_delta_state(user_id):
+    return await asyncio.to_thread(read_json_file, get_delta_state_file(user_id))
+
+async def save_delta_state(user_id, state):
+    await asyncio.to_thread(write_json_file, get_delta_state_file(user_id), state)
+
+def fingerprint_phone_numbers(phone_numbers):
+    """Fingerprint a contact list independently of row order and duplicates."""
+    digest = hashlib.sha256()
+    for phone in sorted(set(phone_numbers)):
+        digest.update(phone.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def compute_csv_delta(previous_results, phone_numbers):
+    """Return the phones added to and removed from a contact list since the last upload."""
+    current = set(phone_numbers)
+    previous = set(previous_results)
+    added = [phone for phone in dict.fromkeys(phone_numbers) if phone not in previous]
+    removed = [phone for phone in previous_results if phone not in current]
+    return added, removed
+
 # Handler to upload CSV
+@interactive_job
 async def upload_csv_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -421,26 +948,48 @@ async def upload_csv_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("❌ لطفاً یک فایل CSV معتبر ارسال کنید.")
             return
 
-        file_path = await file.get_file().download()
         await update.message.reply_text("🔄 در حال پردازش فایل CSV شما. لطفاً صبر کنید...")
 
         try:
-            results = await process_csv(user_id, file_path, download_photos=False)
-            # Save results to JSON
-            result_file = Path(f"results_{user_id}.json")
-            with open(result_file, "w", encoding="utf-8") as f:
-                json.dump(results, f, indent=4, ensure_ascii=False)
+            # Download into memory; parsing, resolution and the results file belong to the job
+            telegram_file = await file.get_file()
+            content = await telegram_file.download_as_bytearray()
+            caption = (update.message.caption or "").strip().lower()
+            result_file = get_results_file(user_id)
+
+            # Delta mode: reuse previous results unless a full re-scan is requested
+            reporter = JobReporter(update, "upload_csv", user_id)
+            try:
+                outcome = await run_job("upload", user_id, {
+                    "csv_text": content.decode("utf-8"),
+                    "full_scan": caption == FULL_SCAN_CAPTION,
+                }, reporter)
+            finally:
+                reporter.finish()
+
+            if outcome is None:
+                await update.message.reply_text("🔍 این فایل نسبت به آپلود قبلی تغییری ندارد.")
+                await send_file(
+                    update.message,
+                    result_file,
+                    filename=f"results_{user_id}.json",
+                    caption="📁 این نتایج بررسی شماره تلفن‌های شما است."
+                )
+                return
 
             # Prepare a summary
-            total = len(results)
-            valid = len([v for v in results.values() if "id" in v])
+            total = outcome["total"]
+            valid = outcome["valid"]
             invalid = total - valid
             summary = f"✅ **پردازش کامل شد!**\n\nکل مخاطبین: {total}\nکاربران معتبر تلگرام: {valid}\nنامعتبر/یافت نشده: {invalid}"
+            if outcome["delta"]:
+                summary += f"\n\nشماره‌های جدید: {outcome['added']}\nشماره‌های حذف شده: {outcome['removed']}\nبررسی مجدد: {outcome['retried']}"
 
             # Send summary and the results file
             await update.message.reply_text(summary, parse_mode="Markdown")
-            await update.message.reply_document(
-                document=InputFile(result_file),
+            await send_file(
+                update.message,
+                result_file,
                 filename=f"results_{user_id}.json",
                 caption="📁 این نتایج بررسی شماره تلفن‌های شما است."
             )
@@ -450,11 +999,47 @@ async def upload_csv_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         await update.message.reply_text("❌ لطفاً یک فایل CSV ارسال کنید.")
 
-# Function to validate and process CSV
-async def process_csv(user_id: int, file_path: str, download_photos: bool):
-    """Process a CSV file with phone numbers."""
+# Function to run an upload; in worker mode it runs in the worker owning the admin
+async def upload_contacts(user_id: int, csv_text: str, full_scan: bool, reporter):
+    """Parse an uploaded CSV and update the admin's results from it."""
+    phone_numbers = await asyncio.to_thread(read_phone_numbers, csv_text)
+    return await update_results(user_id, phone_numbers, full_scan, reporter)
+
+# Function to resolve an uploaded contact list into the results file
+async def update_results(user_id: int, phone_numbers: list, full_scan: bool, reporter):
+    """Resolve a contact list and save the results, or return None if it is unchanged."""
+    fingerprint = fingerprint_phone_numbers(phone_numbers)
+    async with results_lock(user_id):
+        previous_results = {} if full_scan else await load_results(user_id)
+
+        retryable = [phone for phone in dict.fromkeys(phone_numbers) if phone in previous_results and not previous_results[phone].reusable]
+        if previous_results and not retryable and (await load_delta_state(user_id)).get("fingerprint") == fingerprint:
+            return None
+
+        added, removed = compute_csv_delta(previous_results, phone_numbers)
+        results = await process_csv(user_id, phone_numbers, download_photos=False, previous_results=previous_results, reporter=reporter)
+
+        # Save results to JSON
+        await save_results(user_id, results)
+        await save_delta_state(user_id, {
+            "fingerprint": fingerprint,
+            "updated_at": datetime.now().isoformat(),
+        })
+
+    return {
+        "total": len(results),
+        "valid": len([v for v in results.values() if v.resolved]),
+        "delta": bool(previous_results),
+        "added": len(added),
+        "removed": len(removed),
+        "retried": len(retryable),
+    }
+
+# Function to read phone numbers from a CSV file
+def read_phone_numbers(content: str):
+    """Read the phone numbers from the first column of a downloaded CSV file."""
     phone_numbers = []
-    with open(file_path, newline="", encoding="utf-8") as csvfile:
+    with io.StringIO(content, newline="") as csvfile:
         reader = csv.reader(csvfile)
         header = next(reader, None)  # Skip header if exists
         for row in reader:
@@ -462,35 +1047,55 @@ async def process_csv(user_id: int, file_path: str, download_photos: bool):
                 phone = row[0].strip()
                 if phone:
                     phone_numbers.append(phone)
+    return phone_numbers
+
+# Function to validate and process CSV
+async def process_csv(user_id: int, phone_numbers: list, download_photos: bool, previous_results: dict = None, reporter: JobReporter = None):
+    """Resolve phone numbers, reusing previous results for phones already checked."""
+    previous_results = previous_results or {}
+    reporter = reporter or JobReporter(None, "upload_csv", user_id)
+
+    # Placeholders keep the results in CSV order
+    results = {}
+    pending = []
+    for phone in phone_numbers:
+        if phone in results:
+            continue
+        previous = previous_results.get(phone)
+        telemetry.record_cache("results", previous is not None and previous.reusable)
+        if previous is not None and previous.reusable:
+            results[phone] = previous
+        else:
+            results[phone] = None
+            pending.append(phone)
 
+    results.update(await resolve_phone_numbers(user_id, pending, download_photos, reporter))
+    return results
+
+async def resolve_phone_numbers(user_id: int, phone_numbers: list, download_photos: bool, reporter):
+    """Resolve phone numbers one by one, reporting progress after each."""
+    await reporter.start(len(phone_numbers))
+    blocked_users = get_session(user_id).get("blocked_users", [])
     results = {}
     for phone in phone_numbers:
         # Check if user is blocked
-        session_data = get_session(user_id)
-        blocked_users = session_data.get("blocked_users", [])
         if phone in blocked_users:
-            results[phone] = {"error": "کاربر مسدود شده است."}
-            continue
-        results[phone] = await get_names(user_id, phone, download_photos)
-        await asyncio.sleep(1)  # Avoid hitting API rate limits
+            results[phone] = ResolutionResult(error=ResultError.BLOCKED)
+        else:
+            results[phone] = await get_names(user_id, phone, download_photos)
+            await asyncio.sleep(RATE_LIMIT_DELAY)
+        await reporter.progress()
     return results
 
-async def get_names(user_id: int, phone_number: str, download_profile_photos: bool) -> dict:
+async def get_names(user_id: int, phone_number: str, download_profile_photos: bool) -> ResolutionResult:
     """Check if a phone number is associated with a Telegram account."""
-    result = {}
+    result = ResolutionResult()
     try:
-        session_data = get_session(user_id)
-        if not session_data.get("string_session") or not session_data.get("api_id") or not session_data.get("api_hash"):
-            result.update({"error": "حساب تلگرام شما تنظیم نشده است."})
+        client = await get_client(user_id)
+        if client is None:
+            result.error = ResultError.NOT_SET_UP
             return result
 
-        string_session = session_data.get("string_session")
-        api_id = session_data.get("api_id")
-        api_hash = session_data.get("api_hash")
-
-        client = TelegramClient(StringSession(string_session), api_id, api_hash)
-        await client.connect()
-
         contact = types.InputPhoneContact(
             client_id=0, phone=phone_number, first_name="", last_name=""
         )
@@ -499,27 +1104,10 @@ async def get_names(user_id: int, phone_number: str, download_profile_photos: bo
         number_of_matches = len(users)
 
         if number_of_matches == 0:
-            result.update({
-                "error": "هیچ پاسخی دریافت نشد، شماره تلفن در تلگرام وجود ندارد یا دسترسی اضافه کردن مخاطب مسدود شده است."
-            })
+            result.error = ResultError.NOT_FOUND
         elif number_of_matches == 1:
             user = users[0]
-            result.update({
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "fake": user.fake,
-                "verified": user.verified,
-                "premium": user.premium,
-                "mutual_contact": user.mutual_contact,
-                "bot": user.bot,
-                "bot_chat_history": user.bot_chat_history,
-                "restricted": user.restricted,
-                "restriction_reason": user.restriction_reason,
-                "user_was_online": get_human_readable_user_status(user.status),
-                "phone": user.phone,
-            })
+            result = describe_user(user)
             if download_profile_photos and user.photo:
                 try:
                     photo_output_path = Path(f"photos/{user.id}_{phone_number}_photo.jpeg")
@@ -530,45 +1118,147 @@ async def get_names(user_id: int, phone_number: str, download_profile_photos: bo
                     )
                     if photo is not None:
                         logger.info(f"Photo downloaded at '{photo}'")
-                        result["photo_path"] = str(photo)
+                        result.photo_path = str(photo)
                     else:
                         logger.info(f"No photo found for {user.id} ({phone_number})")
                 except Exception as e:
                     logger.exception(f"Unable to download profile photo for {phone_number}. Error: {e}")
         else:
-            result.update({
-                "error": "این شماره تلفن با چندین حساب تلگرام مطابقت دارد، که غیرمنتظره است."
-            })
+            result.error = ResultError.MULTIPLE_MATCHES
 
         # Clean up by deleting the imported contact
         try:
-            if "id" in result:
+            if result.resolved:
                 await client(functions.contacts.DeleteContactsRequest(id=[user.id]))
             else:
                 await client(functions.contacts.DeleteContactsRequest(id=[]))
         except Exception as e:
             logger.warning(f"Failed to delete contact {phone_number}: {e}")
-
-        await client.disconnect()
     except Exception as e:
         logger.exception(f"Unhandled exception for phone {phone_number}: {e}")
-        result.update({"error": f"خطای غیرمنتظره: {e}."})
+        result.error = ResultError.UNEXPECTED
+        result.error_detail = str(e)
     return result
 
-def get_human_readable_user_status(status: types.TypeUserStatus):
-    """Convert Telegram user status to a human-readable format."""
+def describe_user(user: types.User) -> ResolutionResult:
+    """Extract the result fields of a Telegram user."""
+    status, was_online = get_user_status(user.status)
+    return ResolutionResult(
+        id=user.id,
+        access_hash=user.access_hash,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        fake=user.fake,
+        verified=user.verified,
+        premium=user.premium,
+        mutual_contact=user.mutual_contact,
+        bot=user.bot,
+        bot_chat_history=user.bot_chat_history,
+        restricted=user.restricted,
+        restriction_reason=[reason.text for reason in user.restriction_reason] if user.restriction_reason else None,
+        status=status,
+        was_online=was_online,
+        phone=user.phone,
+        checked_at=time.time(),
+    )
+
+def get_user_status(status: types.TypeUserStatus):
+    """Convert Telegram user status to a status code and last-seen time."""
     if isinstance(status, types.UserStatusOnline):
-        return "آنلاین است"
+        return UserStatus.ONLINE, None
     elif isinstance(status, types.UserStatusOffline):
-        return status.was_online.strftime("%Y-%m-%d %H:%M:%S")
+        return UserStatus.OFFLINE, status.was_online
     elif isinstance(status, types.UserStatusRecently):
-        return "به تازگی دیده شده"
+        return UserStatus.RECENTLY, None
     elif isinstance(status, types.UserStatusLastWeek):
-        return "هفته گذشته دیده شده"
+        return UserStatus.LAST_WEEK, None
     elif isinstance(status, types.UserStatusLastMonth):
-        return "ماه گذشته دیده شده"
+        return UserStatus.LAST_MONTH, None
     else:
-        return "ناشناس"
+        return UserStatus.UNKNOWN, None
+
+# Settings for the background refresh of stale results
+REFRESH_INTERVAL = 600  # Seconds between refresh windows
+REFRESH_BATCH_SIZE = 50  # Users refreshed per admin and window
+REFRESH_MAX_AGE = 24 * 60 * 60  # Results older than this are considered stale
+
+def select_stale_results(results, batch_size):
+    """Pick the oldest resolved results that carry a cached access hash."""
+    cutoff = time.time() - REFRESH_MAX_AGE
+    stale = []
+    for phone, data in results.items():
+        if not data.resolved or not data.access_hash:
+            continue
+        checked_at = data.checked_at or 0
+        if checked_at < cutoff:
+            stale.append((checked_at, phone))
+    stale.sort()
+    return [phone for _, phone in stale[:batch_size]]
+
+async def refresh_results(user_id):
+    """Refresh a batch of stale results of an admin using cached access hashes."""
+    async with results_lock(user_id):
+        version = get_results_version(user_id)
+        results = await load_results(user_id)
+        phones = select_stale_results(results, REFRESH_BATCH_SIZE)
+        if not phones:
+            return 0
+
+        client = await get_client(user_id)
+        if client is None:
+            return 0
+
+        input_users = [
+            types.InputUser(user_id=results[phone].id, access_hash=results[phone].access_hash)
+            for phone in phones
+        ]
+        telemetry.record_request(user_id)
+        users = await client(functions.users.GetUsersRequest(id=input_users))
+
+        # An interactive job started while waiting for Telegram, leave the results to it
+        if active_jobs:
+            return 0
+
+        users_by_id = {user.id: user for user in users if isinstance(user, types.User)}
+        for phone in phones:
+            user = users_by_id.get(results[phone].id)
+            if user is not None:
+                record = describe_user(user)
+                # Telegram hides the phone once the imported contact is gone
+                record.phone = results[phone].phone
+                record.photo_path = results[phone].photo_path
+                results[phone] = record
+            else:
+                results[phone].checked_at = time.time()
+
+        # Another process rewrote the results while waiting for Telegram, drop this batch
+        if get_results_version(user_id) != version:
+            return 0
+        await save_results(user_id, results)
+    return len(phones)
+
+async def refresh_stale_results(owns=lambda user_id: True):
+    """Periodically refresh stale results while no interactive jobs are running."""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        for user_id in list(load_sessions()):
+            if not owns(int(user_id)):
+                continue
+            if active_jobs:
+                logger.info("Skipping results refresh while interactive jobs are running.")
+                break
+            try:
+                refreshed = await refresh_results(user_id)
+                if refreshed:
+                    logger.info(f"Refreshed {refreshed} stale result(s) for {user_id}")
+            except errors.FloodWaitError as e:
+                logger.warning(f"FloodWait of {e.seconds}s during results refresh, pausing.")
+                telemetry.record_flood_wait(user_id, e.seconds)
+                await asyncio.sleep(e.seconds)
+                break
+            except Exception as e:
+                logger.warning(f"Failed to refresh results for {user_id}: {e}")
 
 # Function to export added users
 async def export_added_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -583,8 +1273,9 @@ async def export_added_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    await update.message.reply_document(
-        document=InputFile(result_file),
+    await send_file(
+        update.message,
+        result_file,
         filename=f"results_{user_id}.json",
         caption="📁 لیست کاربران اضافه شده شما"
     )
@@ -602,8 +1293,9 @@ async def export_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    await update.message.reply_document(
-        document=InputFile(result_file),
+    await send_file(
+        update.message,
+        result_file,
         filename=f"progress_{user_id}.json",
         caption="📁 پیشرفت پردازش شماره تلفن‌های شما"
     )
@@ -621,10 +1313,9 @@ async def list_user_ids(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    with open(result_file, "r", encoding="utf-8") as f:
-        results = json.load(f)
+    results = await load_results(user_id)
 
-    user_ids = [str(data["id"]) for data in results.values() if "id" in data]
+    user_ids = [str(data.id) for data in results.values() if data.resolved]
     user_ids_str = ", ".join(user_ids) if user_ids else "هیچ کاربری اضافه نشده است."
 
     await update.message.reply_text(f"🔢 **لیست شناسه‌های کاربران اضافه شده:**\n{user_ids_str}")
@@ -636,7 +1327,7 @@ async def manage_blocked_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
 
     # Fetch blocked users
-    blocked_users = sessions.get(str(user_id), {}).get("blocked_users", [])
+    blocked_users = get_session(user_id).get("blocked_users", [])
 
     if not blocked_users:
         blocked_text = "🛑 **لیست کاربران مسدود شده خالی است.**"
@@ -659,7 +1350,196 @@ async def manage_blocked_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     await query.edit_message_text(blocked_text, reply_markup=reply_markup)
 
+# Outcomes recorded in the add-to-group ledger
+LEDGER_ADDED = "added"
+LEDGER_ALREADY_MEMBER = "already_member"
+LEDGER_PRIVACY_RESTRICTED = "privacy_restricted"
+LEDGER_FLOOD = "flood"
+LEDGER_FAILED = "failed"
+TERMINAL_OUTCOMES = {LEDGER_ADDED, LEDGER_ALREADY_MEMBER, LEDGER_PRIVACY_RESTRICTED}
+
+# Retry policy for failed and flood entries
+LEDGER_MAX_ATTEMPTS = 5
+LEDGER_RETRY_BASE_DELAY = 60  # Seconds, doubled on every attempt
+FLOOD_SLEEP_LIMIT = 60  # Longer FloodWaits stop the run instead of sleeping
+
+# Helper functions to manage the per-(admin, group) ledger
+def get_ledger_file(user_id, group_username):
+    return Path(f"ledger_{user_id}_{group_username.lstrip('@').lower()}.jsonl")
+
+def read_ledger_file(path):
+    """Collapse an append-only ledger into its latest entry per user."""
+    if not path.exists():
+        # Ledgers written before the append-only format
+        return read_json_file(path.with_suffix(".json"))
+    ledger = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can only leave the last line incomplete
+                continue
+            ledger[str(entry.pop("id"))] = entry
+    return ledger
+
+def compact_ledger_file(path):
+    """Rewrite a ledger with one line per user, atomically."""
+    ledger = read_ledger_file(path)
+    replace_file(path, lambda f: f.writelines(
+        json.dumps({"id": target_id, **entry}, ensure_ascii=False) + "\n" for target_id, entry in ledger.items()
+    ))
+    return ledger
+
+def append_ledger_line(path, target_id, entry):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": target_id, **entry}, ensure_ascii=False) + "\n")
+
+async def load_ledger(user_id, group_username):
+    # Compacting once per run keeps the file proportional to the number of users
+    return await asyncio.to_thread(compact_ledger_file, get_ledger_file(user_id, group_username))
+
+async def save_ledger_entry(user_id, group_username, target_id, entry):
+    # Each outcome is appended as one line instead of rewriting the whole ledger
+    await asyncio.to_thread(append_ledger_line, get_ledger_file(user_id, group_username), target_id, entry)
+
+def record_outcome(ledger, target_id, phone, outcome, error=None, retry_after=0):
+    """Record the outcome of adding a user and schedule a retry if it is not terminal."""
+    entry = ledger.get(str(target_id), {"phone": phone, "attempts": 0})
+    entry["attempts"] += 1
+    entry["outcome"] = outcome
+    entry["updated_at"] = datetime.now().isoformat()
+    if outcome in TERMINAL_OUTCOMES:
+        entry.pop("error", None)
+        entry.pop("next_attempt_at", None)
+    else:
+        delay = max(retry_after, LEDGER_RETRY_BASE_DELAY * 2 ** (entry["attempts"] - 1))
+        entry["error"] = error
+        entry["next_attempt_at"] = time.time() + delay
+    ledger[str(target_id)] = entry
+
+# Reasons for not trying a user on an add run
+SKIP_BLOCKED = "blocked"
+SKIP_DONE = "done"
+SKIP_EXHAUSTED = "exhausted"
+SKIP_WAITING = "waiting"
+
+def ledger_skip_reason(entry):
+    """Return why a user is not (re)tried on this run, or None if it is due."""
+    if entry is None:
+        return None
+    if entry["outcome"] in TERMINAL_OUTCOMES:
+        return SKIP_DONE
+    if entry["attempts"] >= LEDGER_MAX_ATTEMPTS:
+        return SKIP_EXHAUSTED
+    if time.time() < entry.get("next_attempt_at", 0):
+        return SKIP_WAITING
+    return None
+
+# Ledger files with an add run in progress, so two runs never share a ledger
+active_group_runs = set()
+
+# Function to add the users of the last results to a group/channel
+async def add_users_to_group(user_id: int, group_username: str, reporter):
+    """Add the resolved users to a group, allowing one run per (admin, group) at a time."""
+    ledger_file = get_ledger_file(user_id, group_username)
+    if ledger_file in active_group_runs:
+        raise RuntimeError("افزودن کاربران به این گروه در حال انجام است.")
+    active_group_runs.add(ledger_file)
+    try:
+        return await run_group_additions(user_id, group_username, reporter)
+    finally:
+        active_group_runs.discard(ledger_file)
+
+async def run_group_additions(user_id: int, group_username: str, reporter):
+    """Add the resolved users to a group, recording each outcome in the ledger."""
+    # Get the Telethon client for this user
+    client = await get_client(user_id)
+    if client is None:
+        raise RuntimeError("حساب تلگرام شما تنظیم نشده است.")
+    session_data = get_session(user_id)
+
+    group = await client.get_entity(group_username)
+
+    # Load last results
+    results = await load_results(user_id)
+
+    # Users with a terminal outcome or a pending retry in the ledger are skipped
+    ledger = await load_ledger(user_id, group_username)
+    blocked_users = session_data.get("blocked_users", [])
+    pending = []
+    skipped = Counter()
+    for phone, data in results.items():
+        if not data.resolved:
+            continue
+        # Check if the user is blocked
+        if data.id in blocked_users:
+            logger.info(f"User {data.id} is blocked and will not be added.")
+            skipped[SKIP_BLOCKED] += 1
+            continue
+        reason = ledger_skip_reason(ledger.get(str(data.id)))
+        if reason is None:
+            pending.append((phone, data))
+        else:
+            skipped[reason] += 1
+
+    total_valid = len(pending)
+    run_outcomes = {}
+    current = 0
+
+    await reporter.start(total_valid)
+    for phone, data in pending:
+        outcome = None
+        flood_seconds = 0
+        try:
+            user = await client.get_entity(data.id)
+            await client(functions.messages.AddChatUserRequest(
+                chat_id=group.id,
+                user_id=user,
+                fwd_limit=10  # Number of recent messages to forward
+            ))
+            outcome = LEDGER_ADDED
+            record_outcome(ledger, data.id, phone, outcome)
+            current += 1
+            # Send progress update
+            progress = f"✅ افزودن {current} از {total_valid} کاربران موفقیت‌آمیز بود."
+            await reporter.message(progress)
+        except errors.UserAlreadyParticipantError:
+            outcome = LEDGER_ALREADY_MEMBER
+            record_outcome(ledger, data.id, phone, outcome)
+        except (errors.UserPrivacyRestrictedError, errors.UserNotMutualContactError) as e:
+            outcome = LEDGER_PRIVACY_RESTRICTED
+            record_outcome(ledger, data.id, phone, outcome, error=str(e))
+        except errors.FloodWaitError as e:
+            outcome = LEDGER_FLOOD
+            flood_seconds = e.seconds
+            logger.warning(f"FloodWait of {e.seconds}s while adding user {data.id}")
+            record_outcome(ledger, data.id, phone, outcome, error=str(e), retry_after=e.seconds)
+        except Exception as e:
+            outcome = LEDGER_FAILED
+            logger.error(f"افزودن کاربر {data.id} به گروه ناموفق بود: {e}")
+            record_outcome(ledger, data.id, phone, outcome, error=str(e))
+
+        # Persist every outcome as it happens so a restart can resume
+        await save_ledger_entry(user_id, group_username, data.id, ledger[str(data.id)])
+        run_outcomes[outcome] = run_outcomes.get(outcome, 0) + 1
+        await reporter.progress(flood_seconds)
+
+        if outcome == LEDGER_FLOOD:
+            if flood_seconds > FLOOD_SLEEP_LIMIT:
+                await reporter.message(
+                    f"⏳ محدودیت تلگرام (FloodWait). ادامه کار پس از {flood_seconds} ثانیه با ارسال دوباره نام گروه امکان‌پذیر است."
+                )
+                break
+            await asyncio.sleep(flood_seconds)
+
+        # To avoid hitting rate limits
+        await asyncio.sleep(RATE_LIMIT_DELAY)
+
+    return {"outcomes": run_outcomes, "skipped": dict(skipped)}
+
 # Handler to add users to group/channel
+@interactive_job
 async def add_to_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -674,83 +1554,407 @@ async def add_to_group_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(f"🔄 در حال افزودن کاربران به {group_username}. لطفاً صبر کنید...")
 
     try:
-        # Initialize Telethon client for this user
-        session_data = get_session(user_id)
-        if not session_data.get("string_session") or not session_data.get("api_id") or not session_data.get("api_hash"):
+        if not get_session(user_id).get("string_session"):
             await update.message.reply_text("❌ حساب تلگرام شما تنظیم نشده است.")
             return
 
-        string_session = session_data.get("string_session")
-        api_id = session_data.get("api_id")
-        api_hash = session_data.get("api_hash")
-
-        client = TelegramClient(StringSession(string_session), api_id, api_hash)
-        await client.connect()
-
-        group = await client.get_entity(group_username)
-
-        # Load last results
-        result_file = Path(f"results_{user_id}.json")
-        if not result_file.exists():
+        if not get_results_file(user_id).exists():
             await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
-            await client.disconnect()
             return
 
-        with open(result_file, "r", encoding="utf-8") as f:
-            results = json.load(f)
+        reporter = JobReporter(update, "add_to_group", user_id)
+        try:
+            outcome = await run_job("add", user_id, {"group_username": group_username}, reporter)
+        finally:
+            reporter.finish()
+        run_outcomes = outcome["outcomes"]
+        skipped = outcome["skipped"]
 
-        added_users = []
-        failed_users = []
-        total_valid = len([v for v in results.values() if "id" in v])
-        current = 0
+        # Prepare a summary
+        summary = (
+            f"✅ **افزودن کاربران به گروه/کانال کامل شد!**\n\n"
+            f"تعداد موفق: {run_outcomes.get(LEDGER_ADDED, 0)}\n"
+            f"از قبل عضو: {run_outcomes.get(LEDGER_ALREADY_MEMBER, 0)}\n"
+            f"محدودیت حریم خصوصی: {run_outcomes.get(LEDGER_PRIVACY_RESTRICTED, 0)}\n"
+            f"محدودیت FloodWait: {run_outcomes.get(LEDGER_FLOOD, 0)}\n"
+            f"تعداد ناموفق: {run_outcomes.get(LEDGER_FAILED, 0)}\n"
+            f"رد شده (از اجرای قبلی): {skipped.get(SKIP_DONE, 0)}\n"
+            f"در انتظار تلاش مجدد: {skipped.get(SKIP_WAITING, 0)}\n"
+            f"بیش از حد مجاز تلاش: {skipped.get(SKIP_EXHAUSTED, 0)}\n"
+            f"مسدود شده: {skipped.get(SKIP_BLOCKED, 0)}"
+        )
 
-        for phone, data in results.items():
-            if "id" in data:
-                # Check if the user is blocked
-                blocked_users = session_data.get("blocked_users", [])
-                if data["id"] in blocked_users:
-                    logger.info(f"User {data['id']} is blocked and will not be added.")
-                    continue
+        await update.message.reply_text(summary, parse_mode="Markdown")
+        await update.message.reply_text(f"📄 برای دریافت گزارش کامل: /export_ledger {group_username}")
 
-                try:
-                    user = await client.get_entity(data["id"])
-                    await client(functions.messages.AddChatUserRequest(
-                        chat_id=group.id,
-                        user_id=user,
-                        fwd_limit=10  # Number of recent messages to forward
-                    ))
-                    added_users.append(user.username or str(user.id))
-                    current += 1
-                    # Send progress update
-                    progress = f"✅ افزودن {current} از {total_valid} کاربران موفقیت‌آمیز بود."
-                    await update.message.reply_text(progress)
-                    # To avoid hitting rate limits
-                    await asyncio.sleep(1)  # Adjust as necessary
-                except Exception as e:
-                    logger.error(f"افزودن کاربر {data['id']} به گروه ناموفق بود: {e}")
-                    failed_users.append(phone)
-                    await asyncio.sleep(1)  # Adjust as necessary
+    except Exception as e:
+        logger.error(f"Error adding users to group: {e}")
+        await update.message.reply_text(f"❌ خطایی رخ داد: {e}")
 
-        # Prepare a summary
-        success_count = len(added_users)
-        failure_count = len(failed_users)
-        summary = f"✅ **افزودن کاربران به گروه/کانال کامل شد!**\n\nتعداد موفق: {success_count}\nتعداد ناموفق: {failure_count}"
+# Worker mode: resolution and add jobs run in separate processes, fed through a local SQLite queue
+JOBS_DB = Path("jobs.db")
+WORKER_POLL_INTERVAL = 0.2  # Seconds between queue polls
+WORKER_STALL_TIMEOUT = 15 * 60  # Running jobs silent for longer than this are given up
+WORKER_RESTART_DELAY = 30  # Minimum seconds between restarts of the same worker
+WORKER_TELEMETRY_INTERVAL = 5  # Seconds between telemetry snapshots sent by a worker
+
+# Set by main_bot() when worker mode is enabled
+worker_queue = None
+worker_processes = []
+
+class WorkerQueue:
+    """Job queue shared by the bot frontend and its worker processes."""
+
+    def __init__(self, path=JOBS_DB, processes=()):
+        self.path = path
+        self.processes = processes
+        self.restarted_at = {}
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def execute(self, sql, params=()):
+        # One connection per process, used from worker threads one statement at a time
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            return self.connection.execute(sql, params).fetchall()
+
+    def reset(self):
+        """Create empty tables, dropping jobs left over from a previous run."""
+        with closing(sqlite3.connect(self.path)) as connection:
+            connection.executescript("""
+                DROP TABLE IF EXISTS jobs;
+                DROP TABLE IF EXISTS job_events;
+                DROP TABLE IF EXISTS worker_telemetry;
+                CREATE TABLE jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    claimed_at REAL,
+                    worker_pid INTEGER
+                );
+                CREATE TABLE job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX job_events_job_id ON job_events (job_id, id);
+                CREATE TABLE worker_telemetry (
+                    worker INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+            """)
+
+    def enqueue(self, kind, user_id, payload):
+        rows = self.execute(
+            "INSERT INTO jobs (kind, user_id, payload) VALUES (?, ?, ?) RETURNING id",
+            (kind, user_id, json.dumps(payload, ensure_ascii=False)),
+        )
+        return rows[0][0]
+
+    def claim(self, worker_index, worker_count):
+        """Take the queued jobs of the admins owned by a worker."""
+        return self.execute(
+            "UPDATE jobs SET status = 'running', claimed_at = ?, worker_pid = ? "
+            "WHERE status = 'queued' AND user_id % ? = ? "
+            "RETURNING id, kind, user_id, payload",
+            (time.time(), os.getpid(), worker_count, worker_index),
+        )
 
-        await update.message.reply_text(summary, parse_mode="Markdown")
+    def claim_of(self, job_id):
+        """Return when and by which worker process a job was claimed."""
+        rows = self.execute("SELECT claimed_at, worker_pid FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else (None, None)
+
+    def worker_running(self, pid):
+        return any(process.pid == pid and process.is_alive() for process in self.processes)
+
+    def revive_workers(self):
+        """Restart worker processes that exited, so their admins' later jobs are served again."""
+        for worker_index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            if time.time() - self.restarted_at.get(worker_index, 0) < WORKER_RESTART_DELAY:
+                continue
+            logger.error(f"Worker {worker_index} exited with code {process.exitcode}, restarting it")
+            self.restarted_at[worker_index] = time.time()
+            self.processes[worker_index] = start_worker(worker_index, len(self.processes))
+
+    def save_telemetry(self, worker_index, snapshot):
+        self.execute(
+            "INSERT INTO worker_telemetry (worker, data) VALUES (?, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET data = excluded.data",
+            (worker_index, json.dumps(snapshot)),
+        )
 
-        if added_users:
-            added_list = ", ".join(added_users)
-            await update.message.reply_text(f"🟢 **کاربران اضافه شده:**\n{added_list}")
+    def load_telemetry(self):
+        return [json.loads(data) for data, in self.execute("SELECT data FROM worker_telemetry")]
 
-        if failed_users:
-            failed_list = ", ".join(failed_users)
-            await update.message.reply_text(f"🔴 **کاربران اضافه نشده:**\n{failed_list}")
+    def emit(self, job_id, kind, data):
+        self.execute(
+            "INSERT INTO job_events (job_id, kind, data) VALUES (?, ?, ?)",
+            (job_id, kind, json.dumps(data, ensure_ascii=False)),
+        )
 
-        await client.disconnect()
+    def events(self, job_id, after_id):
+        return self.execute(
+            "SELECT id, kind, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+            (job_id, after_id),
+        )
+
+    def remove(self, job_id):
+        self.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        self.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
 
+    async def run(self, kind, user_id, payload, reporter):
+        """Enqueue a job for the worker that owns the admin and relay its events until it finishes."""
+        self.revive_workers()
+        job_id = await asyncio.to_thread(self.enqueue, kind, user_id, payload)
+        last_event_id = 0
+        last_activity = time.time()
+        try:
+            while True:
+                # Read before the events, so events sent just before the worker exited are still seen
+                claimed_at, worker_pid = await asyncio.to_thread(self.claim_of, job_id)
+                worker_alive = worker_pid is None or self.worker_running(worker_pid)
+                for event_id, event_kind, data in await asyncio.to_thread(self.events, job_id, last_event_id):
+                    last_event_id = event_id
+                    last_activity = time.time()
+                    data = json.loads(data)
+                    if event_kind == "start":
+                        await reporter.start(data["total"])
+                    elif event_kind == "progress":
+                        await reporter.progress(data["flood_seconds"])
+                    elif event_kind == "message":
+                        await reporter.message(data["text"])
+                    elif event_kind == "error":
+                        raise RuntimeError(data["error"])
+                    elif event_kind == "done":
+                        return data["value"]
+
+                if not worker_alive:
+                    logger.error(f"Worker owning {user_id} exited while running job {job_id} ({kind})")
+                    self.revive_workers()
+                    raise RuntimeError("پردازشگر این کار متوقف شد و دوباره راه‌اندازی می‌شود. لطفاً دوباره امتحان کنید.")
+                if claimed_at is not None and time.time() - max(last_activity, claimed_at) > WORKER_STALL_TIMEOUT:
+                    logger.error(f"Job {job_id} ({kind}) of {user_id} sent no events for {WORKER_STALL_TIMEOUT}s")
+                    raise RuntimeError("پردازشگر این کار پاسخ نمی‌دهد.")
+                if claimed_at is None:
+                    # A queued job waits for its worker, which may have to be restarted first
+                    self.revive_workers()
+                await asyncio.sleep(WORKER_POLL_INTERVAL)
+        finally:
+            await asyncio.to_thread(self.remove, job_id)
+
+class WorkerJobReporter:
+    """Stream the progress of a job from a worker process back to the frontend."""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    async def emit(self, kind, **data):
+        await asyncio.to_thread(self.queue.emit, self.job_id, kind, data)
+
+    async def start(self, total):
+        await self.emit("start", total=total)
+
+    async def progress(self, flood_seconds=0):
+        await self.emit("progress", flood_seconds=flood_seconds)
+
+    async def message(self, text):
+        await self.emit("message", text=text)
+
+JOB_FUNCTIONS = {
+    "upload": upload_contacts,
+    "add": add_users_to_group,
+}
+
+async def run_job(kind, user_id, payload, reporter):
+    """Run a job in the worker that owns the admin, or on this event loop without worker mode."""
+    if worker_queue is not None:
+        return await worker_queue.run(kind, user_id, payload, reporter)
+    return await JOB_FUNCTIONS[kind](user_id, reporter=reporter, **payload)
+
+async def run_worker_job(queue, job_id, kind, user_id, payload):
+    global active_jobs
+    reporter = WorkerJobReporter(queue, job_id)
+    # Queued jobs are this process's interactive jobs, so the refresher pauses for them
+    active_jobs += 1
+    try:
+        value = await JOB_FUNCTIONS[kind](user_id, reporter=reporter, **payload)
+        await reporter.emit("done", value=value)
     except Exception as e:
-        logger.error(f"Error adding users to group: {e}")
-        await update.message.reply_text(f"❌ خطایی رخ داد: {e}")
+        logger.exception(f"Worker job {job_id} ({kind}) failed: {e}")
+        await reporter.emit("error", error=str(e))
+    finally:
+        active_jobs -= 1
+
+async def serve_worker(worker_index, worker_count):
+    """Claim and run the jobs of the admins owned by this worker."""
+    global sessions
+    queue = WorkerQueue()
+    owns = lambda user_id: user_id % worker_count == worker_index
+    # Clients and background refreshes of an admin's sessions only ever live in its worker
+    asyncio.create_task(warm_clients(owns))
+    asyncio.create_task(refresh_stale_results(owns))
+    asyncio.create_task(publish_telemetry(queue, worker_index))
+    logger.info(f"Worker {worker_index}/{worker_count} started")
+
+    running = set()
+    while True:
+        claimed = await asyncio.to_thread(queue.claim, worker_index, worker_count)
+        if claimed:
+            # Pick up logins and blocked users changed by the frontend since the last job
+            sessions = None
+        for job_id, kind, user_id, payload in claimed:
+            task = asyncio.create_task(run_worker_job(queue, job_id, kind, user_id, json.loads(payload)))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        await asyncio.sleep(WORKER_POLL_INTERVAL)
+
+async def publish_telemetry(queue, worker_index):
+    """Periodically share this worker's telemetry with the frontend's /stats."""
+    while True:
+        await asyncio.sleep(WORKER_TELEMETRY_INTERVAL)
+        await asyncio.to_thread(queue.save_telemetry, worker_index, telemetry.snapshot())
+
+def worker_main(worker_index, worker_count):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(serve_worker(worker_index, worker_count))
+    except KeyboardInterrupt:
+        pass
+
+def start_worker(worker_index, worker_count):
+    process = multiprocessing.get_context("spawn").Process(
+        target=worker_main,
+        args=(worker_index, worker_count),
+        name=f"worker-{worker_index}",
+        daemon=True,
+    )
+    process.start()
+    return process
+
+def start_workers(worker_count):
+    """Start the worker processes, each owning the admins with user_id % worker_count == its index."""
+    global worker_queue
+    worker_queue = WorkerQueue(processes=worker_processes)
+    worker_queue.reset()
+    for worker_index in range(worker_count):
+        worker_processes.append(start_worker(worker_index, worker_count))
+
+# Helper function to format durations for /stats and /jobs
+def format_duration(seconds):
+    if seconds is None:
+        return "نامشخص"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+# Command Handler: /stats
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show per-session throughput, FloodWait time, cache hit rates and queue depths."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ شما اجازه استفاده از این ربات را ندارید.")
+        return
+
+    # In worker mode, client caches and background refreshes are counted in the workers
+    stats = telemetry
+    if worker_queue is not None:
+        stats = Telemetry()
+        stats.merge(telemetry.snapshot())
+        for snapshot in await asyncio.to_thread(worker_queue.load_telemetry):
+            stats.merge(snapshot)
+
+    lines = ["📊 آمار لحظه‌ای ربات", "", "نشست‌ها:"]
+    session_ids = sorted(set(stats.requests) | set(stats.flood_wait))
+    if not session_ids:
+        lines.append("• هنوز درخواستی ثبت نشده است.")
+    for session_id in session_ids:
+        lines.append(
+            f"• {session_id}: {stats.throughput(session_id):.2f} درخواست/ثانیه، "
+            f"FloodWait: {format_duration(stats.flood_wait.get(session_id, 0))}"
+        )
+
+    lines += ["", "نرخ استفاده از کش:"]
+    cache_names = sorted(set(stats.cache_hits) | set(stats.cache_misses))
+    if not cache_names:
+        lines.append("• هنوز داده‌ای ثبت نشده است.")
+    for name in cache_names:
+        hits = stats.cache_hits.get(name, 0)
+        total = hits + stats.cache_misses.get(name, 0)
+        lines.append(f"• {name}: {hits / total:.0%} ({hits}/{total})")
+
+    pending_rows = sum(job.total - job.done for job in telemetry.active.values())
+    lines += [
+        "",
+        "صف‌ها:",
+        f"• به‌روزرسانی‌های در انتظار: {context.application.update_queue.qsize()}",
+        f"• کارهای در حال اجرا: {len(telemetry.active)}",
+        f"• ردیف‌های در انتظار: {pending_rows}",
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+# Command Handler: /jobs
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List active and finished jobs with rows/sec and ETA."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ شما اجازه استفاده از این ربات را ندارید.")
+        return
+
+    lines = ["🧾 کارهای در حال اجرا:"]
+    if not telemetry.active:
+        lines.append("• کاری در حال اجرا نیست.")
+    for job in telemetry.active.values():
+        lines.append(
+            f"• #{job.job_id} {job.kind} (ادمین {job.user_id}): {job.done}/{job.total}، "
+            f"{job.rate():.2f} ردیف/ثانیه، زمان باقی‌مانده: {format_duration(job.eta())}"
+        )
+
+    lines += ["", "✅ کارهای پایان یافته:"]
+    if not telemetry.finished:
+        lines.append("• کاری پایان نیافته است.")
+    for job in reversed(telemetry.finished):
+        elapsed = job.finished_at - job.started_at
+        lines.append(
+            f"• #{job.job_id} {job.kind} (ادمین {job.user_id}): {job.done}/{job.total} "
+            f"در {format_duration(elapsed)}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+# Handler to export the add-to-group ledger
+async def export_ledger_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Export the add-to-group ledger of a group as a JSON file."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ شما اجازه استفاده از این ربات را ندارید.")
+        return
+
+    if len(context.args) != 1 or not context.args[0].startswith("@"):
+        await update.message.reply_text("❌ لطفاً نام کاربری گروه/کانال را با فرمت: /export_ledger @yourgroup ارسال کنید.")
+        return
+
+    group_username = context.args[0]
+    ledger_file = get_ledger_file(user_id, group_username)
+    ledger = await asyncio.to_thread(read_ledger_file, ledger_file)
+    if not ledger:
+        await update.message.reply_text("❌ گزارشی برای این گروه/کانال موجود نیست.")
+        return
+
+    # The collapsed ledger is exported as a single JSON document
+    content = await asyncio.to_thread(lambda: json.dumps(ledger, indent=4, ensure_ascii=False).encode("utf-8"))
+    await update.message.reply_document(
+        document=content,
+        filename=ledger_file.with_suffix(".json").name,
+        caption=f"📁 گزارش افزودن کاربران به {group_username}"
+    )
 
 # Handler to unblock a user
 async def unblock_user(update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
@@ -827,8 +2031,9 @@ async def export_added_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    await update.message.reply_document(
-        document=InputFile(result_file),
+    await send_file(
+        update.message,
+        result_file,
         filename=f"results_{user_id}.json",
         caption="📁 لیست کاربران اضافه شده شما"
     )
@@ -846,8 +2051,9 @@ async def export_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    await update.message.reply_document(
-        document=InputFile(result_file),
+    await send_file(
+        update.message,
+        result_file,
         filename=f"progress_{user_id}.json",
         caption="📁 پیشرفت پردازش شماره تلفن‌های شما"
     )
@@ -865,10 +2071,9 @@ async def list_user_ids(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ فایل نتایج موجود نیست. لطفاً ابتدا یک فایل CSV آپلود کنید.")
         return
 
-    with open(result_file, "r", encoding="utf-8") as f:
-        results = json.load(f)
+    results = await load_results(user_id)
 
-    user_ids = [str(data["id"]) for data in results.values() if "id" in data]
+    user_ids = [str(data.id) for data in results.values() if data.resolved]
     user_ids_str = ", ".join(user_ids) if user_ids else "هیچ کاربری اضافه نشده است."
 
     await update.message.reply_text(f"🔢 **لیست شناسه‌های کاربران اضافه شده:**\n{user_ids_str}")
@@ -891,26 +2096,361 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         await update.message.reply_text("❓ لطفاً از دکمه‌های ارائه شده استفاده کنید یا یک دستور معتبر ارسال کنید.")
 
-# Main function to run the bot
-async def main_bot():
-    """Main function to run the bot."""
+# Opt-in event loop watchdog and handler profiler
+WATCHDOG_INTERVAL = 0.05  # Seconds between event loop heartbeats
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples of a profiled handler
+DIAGNOSTICS_DIR = Path("logs")
+
+# Set by main_bot() when the watchdog is enabled
+watchdog = None
+
+def fold_stack(frame):
+    """Render a stack as one line of the folded format used by flame graph tools."""
+    return ";".join(
+        f"{summary.name} ({os.path.basename(summary.filename)}:{summary.lineno})"
+        for summary in traceback.extract_stack(frame)
+    )
+
+class LoopWatchdog:
+    """Detect event loop stalls from a separate thread and log the stack of the blocking code."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.reported_heartbeat = None
+        self.stop_event = threading.Event()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                self.heartbeat = time.monotonic()
+                await asyncio.sleep(WATCHDOG_INTERVAL)
+                lag = time.monotonic() - self.heartbeat - WATCHDOG_INTERVAL
+                if lag > self.threshold:
+                    logger.warning(f"Event loop lag of {lag * 1000:.0f} ms")
+        finally:
+            self.stop_event.set()
+
+    def watch(self):
+        # While the loop is blocked the heartbeat stops moving, so the loop thread's
+        # current frame is the code that blocks it
+        while not self.stop_event.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - WATCHDOG_INTERVAL
+            if stalled > self.threshold and heartbeat != self.reported_heartbeat:
+                self.reported_heartbeat = heartbeat
+                self.report(stalled)
+
+    def report(self, stalled):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_name() if task else "no task"
+        stack = "".join(traceback.format_stack(frame)) if frame else "unavailable\n"
+        logger.warning(f"Event loop blocked for {stalled * 1000:.0f} ms so far in {task_name}:\n{stack}")
+
+def profile_handler(handler):
+    """Sample the stack of a handler's task while it runs and write folded stacks to logs/."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        loop_thread_id = threading.get_ident()
+        samples = Counter()
+        stop_event = threading.Event()
+
+        def sample():
+            # Only samples taken while the loop is running this handler's task are kept
+            while not stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+                if asyncio.current_task(loop) is not task:
+                    continue
+                frame = sys._current_frames().get(loop_thread_id)
+                if frame is not None:
+                    samples[fold_stack(frame)] += 1
+
+        sampler = threading.Thread(target=sample, name=f"profile-{handler.__name__}", daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            return await handler(update, context)
+        finally:
+            stop_event.set()
+            elapsed = time.perf_counter() - started
+            await asyncio.to_thread(sampler.join)
+            profile_file = await asyncio.to_thread(write_profile, handler.__name__, samples)
+            logger.info(
+                f"Profiled {handler.__name__}: {elapsed:.2f}s wall, "
+                f"{sum(samples.values())} sample(s) on the event loop, written to {profile_file}"
+            )
+    return wrapper
+
+def write_profile(name, samples):
+    DIAGNOSTICS_DIR.mkdir(parents=True, exist_ok=True)
+    profile_file = DIAGNOSTICS_DIR / f"profile_{name}_{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.folded"
+    with open(profile_file, "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return profile_file
+
+def enable_handler_profiling(names):
+    """Replace the named handlers with profiled versions, before the application is built."""
+    for name in names:
+        handler = globals().get(name)
+        if not asyncio.iscoroutinefunction(handler):
+            exit(f"Unknown handler to profile: {name}")
+        globals()[name] = profile_handler(handler)
+
+# Persistence of conversation states and user data in a local SQLite database
+PERSISTENCE_DB = Path("persistence.db")
+PERSISTENCE_UPDATE_INTERVAL = 5  # Seconds between writes of changed data
+
+class SqlitePersistence(BasePersistence):
+    """Store conversation states and user data in SQLite so login flows survive restarts.
+
+    Every user and conversation is a row of its own, so processes sharing the database
+    never overwrite each other's entries, and user data written by another process is
+    picked up before the next update of that user. Conversation states are only read at
+    startup, so all updates of an admin must still reach the same process.
+    """
+
+    def __init__(self, path=PERSISTENCE_DB):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=PERSISTENCE_UPDATE_INTERVAL,
+        )
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+        # Version of each user's row as last read or written by this process
+        self.user_versions = {}
+
+    def execute(self, sql, params=()):
+        # One connection per process, used from worker threads one statement at a time
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.executescript("""
+                    CREATE TABLE IF NOT EXISTS user_data (
+                        user_id INTEGER PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        version INTEGER NOT NULL DEFAULT 1
+                    );
+                    CREATE TABLE IF NOT EXISTS conversations (
+                        name TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (name, key)
+                    );
+                """)
+                # Databases created before user data rows were versioned
+                columns = [row[1] for row in self.connection.execute("PRAGMA table_info(user_data)")]
+                if "version" not in columns:
+                    self.connection.execute("ALTER TABLE user_data ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            return self.connection.execute(sql, params).fetchall()
+
+    async def run(self, sql, params=()):
+        return await asyncio.to_thread(self.execute, sql, params)
+
+    async def get_user_data(self):
+        rows = await self.run("SELECT user_id, data, version FROM user_data")
+        self.user_versions = {user_id: version for user_id, _, version in rows}
+        return {user_id: json.loads(data) for user_id, data, _ in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # Timeouts of restored conversations are not rescheduled, so states older than
+        # the conversation timeout are not restored at all
+        rows = await self.run(
+            "SELECT key, state FROM conversations WHERE name = ? AND updated_at > ?",
+            (name, time.time() - LOGIN_TIMEOUT),
+        )
+        # Conversation keys are tuples of IDs, stored as JSON lists
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        encoded_key = json.dumps(list(key))
+        if new_state is None:
+            await self.run("DELETE FROM conversations WHERE name = ? AND key = ?", (name, encoded_key))
+        else:
+            await self.run(
+                "INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (name, encoded_key, json.dumps(new_state), time.time()),
+            )
+
+    async def update_user_data(self, user_id, data):
+        rows = await self.run(
+            "INSERT INTO user_data (user_id, data) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, version = user_data.version + 1 "
+            "RETURNING version",
+            (user_id, json.dumps(data, ensure_ascii=False)),
+        )
+        self.user_versions[user_id] = rows[0][0]
+
+    async def drop_user_data(self, user_id):
+        await self.run("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+        self.user_versions.pop(user_id, None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Only a row another process wrote replaces the in-memory data, so changes of
+        # this process that are not yet written are kept
+        rows = await self.run("SELECT data, version FROM user_data WHERE user_id = ?", (user_id,))
+        if rows and rows[0][1] != self.user_versions.get(user_id):
+            user_data.clear()
+            user_data.update(json.loads(rows[0][0]))
+            self.user_versions[user_id] = rows[0][1]
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+# Build the Telegram Bot application and register handlers
+def build_application(builder: ApplicationBuilder | None = None) -> Application:
+    """Build the application with all handlers registered.
+
+    A preconfigured builder can be passed in, e.g. to swap the Bot API transport in load tests.
+    """
+    application = (
+        (builder or ApplicationBuilder())
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .persistence(SqlitePersistence())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Conversation Handler Setup
+    setup_telegram_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(button_handler, pattern='^setup_telegram$')],
+        states={
+            API_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_id_handler)],
+            API_HASH: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_hash_handler)],
+            PHONE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, phone_number_handler)],
+            CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, code_handler)],
+            PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, password_handler)],
+            BLOCK_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, block_user_input)],
+        },
+        fallbacks=[],
+        allow_reentry=True,
+        conversation_timeout=LOGIN_TIMEOUT,
+        name="setup_telegram_conv",
+        persistent=True
+    )
+
     # Register handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("add_admin", add_admin_command))
+    application.add_handler(CommandHandler("export_ledger", export_ledger_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("jobs", jobs_command))
     application.add_handler(setup_telegram_conv)
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.Document.ALL, upload_csv_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    return application
+
+async def on_startup(application: Application):
+    """Start background work once the bot starts receiving updates."""
+    # In worker mode the workers own all Telethon sessions, including their refreshes
+    if worker_queue is None:
+        application.create_task(warm_clients())
+        application.create_task(refresh_stale_results())
+    application.create_task(reap_pending_logins(application))
+    if watchdog is not None:
+        application.create_task(watchdog.run())
+
+async def on_shutdown(application: Application):
+    await close_clients()
+    for process in worker_processes:
+        process.terminate()
+
+# Report the time spent in imports and initialization
+def profile_startup():
+    """Time each startup step and print a report."""
+    timings = [("imports", IMPORTS_FINISHED - IMPORTS_STARTED)]
+    steps = [
+        ("load_config", load_config),
+        ("load_sessions", load_sessions),
+        ("build_application", build_application),
+        ("import telethon (off-loop)", lambda: importlib.import_module("telethon")),
+    ]
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings.append((name, time.perf_counter() - started))
+
+    # Telethon is imported in a worker thread by warm_clients(), not on the path to polling
+    critical_path = sum(elapsed for name, elapsed in timings if "off-loop" not in name)
+    report = "\n".join(f"{name:<30} {elapsed * 1000:8.1f} ms" for name, elapsed in timings)
+    report += f"\n{'time to polling':<30} {critical_path * 1000:8.1f} ms"
+    logger.info(f"Startup profile:\n{report}")
+    print(report)
+
+# Main function to run the bot
+def main_bot(watchdog_threshold=None, profiled_handlers=(), workers=0):
+    """Main function to run the bot."""
+    global watchdog
+    load_config()
+    if workers:
+        start_workers(workers)
+    if watchdog_threshold is not None:
+        watchdog = LoopWatchdog(watchdog_threshold / 1000)
+    enable_handler_profiling(profiled_handlers)
+    application = build_application()
 
     # Start the bot
     logger.info("Bot is running...")
-    await application.run_polling()
+    application.run_polling()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram Admin Bot")
+    parser.add_argument("--profile-startup", action="store_true", help="report time spent in imports and initialization, then exit")
+    parser.add_argument("--watchdog-threshold", type=float, metavar="MS", help="log the blocking stack when the event loop stalls longer than MS milliseconds")
+    parser.add_argument("--profile-handler", action="append", default=[], metavar="NAME", help="sample-profile a handler (e.g. upload_csv_handler) into logs/; repeatable")
+    parser.add_argument("--workers", type=int, default=0, metavar="N", help="run resolution and add jobs in N worker processes")
+    args = parser.parse_args()
+
     try:
-        # Start the main_bot coroutine
-        asyncio.run(main_bot())
+        if args.profile_startup:
+            profile_startup()
+        else:
+            main_bot(args.watchdog_threshold, args.profile_handler, args.workers)
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped by user.")
     except Exception as e: